@@ -6,11 +6,18 @@ Architecture:
 2. Anthropic Claude - Text analysis and structured extraction
 """
 
+import asyncio
 import streamlit as st
 from dotenv import load_dotenv
-import os
 
-from core import process_audio, SumarioPaciente
+from core import (
+    process_audios_async,
+    get_api_keys,
+    audio_digest,
+    audio_mime_type,
+    AUDIO_MIME_TYPES,
+    SumarioPaciente
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,7 +36,9 @@ st.set_page_config(
 # CUSTOM CSS
 # =============================================================================
 
-st.markdown("""
+# Emitted on every run on purpose: Streamlit drops any element that a rerun
+# does not re-emit, so gating this behind session_state would lose the styles
+CUSTOM_CSS = """
 <style>
     .summary-box {
         background-color: #f0f2f6;
@@ -52,7 +61,9 @@ st.markdown("""
         font-style: italic;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # =============================================================================
 # HEADER
@@ -71,19 +82,9 @@ st.divider()
 # API KEYS - Check secrets (Streamlit Cloud) or .env
 # =============================================================================
 
-# Try Streamlit secrets first (for Streamlit Cloud deployment)
-try:
-    groq_api_key = st.secrets.get("GROQ_API_KEY", None)
-    anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY", None)
-except:
-    groq_api_key = None
-    anthropic_api_key = None
-
-# Fall back to environment variables (from .env file)
-if not groq_api_key:
-    groq_api_key = os.environ.get("GROQ_API_KEY", None)
-if not anthropic_api_key:
-    anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY", None)
+# Streamlit secrets first (for Streamlit Cloud deployment), then environment
+# variables (from .env file); resolved once per process
+groq_api_key, anthropic_api_key = get_api_keys()
 
 # Show warning if keys are missing
 missing_keys = []
@@ -126,9 +127,10 @@ if missing_keys:
 
 st.markdown("### 📁 Upload do Áudio")
 
-uploaded_file = st.file_uploader(
-    "Arraste um arquivo de áudio ou clique para selecionar",
-    type=["mp3", "wav", "m4a", "opus", "ogg", "webm", "flac"],
+uploaded_files = st.file_uploader(
+    "Arraste um ou mais arquivos de áudio ou clique para selecionar",
+    type=list(AUDIO_MIME_TYPES),
+    accept_multiple_files=True,
     help="Formatos suportados: MP3, WAV, M4A, OPUS, OGG, WebM, FLAC"
 )
 
@@ -136,19 +138,27 @@ uploaded_file = st.file_uploader(
 # AUDIO PREVIEW
 # =============================================================================
 
-if uploaded_file is not None:
+if uploaded_files:
     st.markdown("### 🎧 Prévia do Áudio")
-    st.audio(uploaded_file, format=f"audio/{uploaded_file.name.split('.')[-1]}")
-    # Reset file pointer after preview
-    uploaded_file.seek(0)
+    for uploaded_file in uploaded_files:
+        if len(uploaded_files) > 1:
+            st.caption(uploaded_file.name)
+        st.audio(uploaded_file, format=audio_mime_type(uploaded_file.name))
 
 # =============================================================================
 # PROCESS BUTTON
 # =============================================================================
 
+batch_mode = False
+if uploaded_files and len(uploaded_files) > 1:
+    batch_mode = st.checkbox(
+        "📦 Processar em lote (Batch API)",
+        help="Até 50% mais barato na análise com Claude, porém pode levar vários minutos"
+    )
+
 process_button = st.button(
     "🎯 Gerar Sumário",
-    disabled=uploaded_file is None,
+    disabled=not uploaded_files,
     use_container_width=True
 )
 
@@ -156,55 +166,69 @@ process_button = st.button(
 # PROCESSING
 # =============================================================================
 
-if process_button and uploaded_file is not None:
-    
-    # Step 1: Transcription with Groq Whisper
-    with st.spinner("🎤 Transcrevendo áudio com Whisper (Groq)..."):
-        try:
-            audio_bytes = uploaded_file.read()
-            
-            from core import transcribe_audio
-            transcription = transcribe_audio(
-                audio_bytes=audio_bytes,
-                filename=uploaded_file.name,
-                groq_api_key=groq_api_key
-            )
-            st.session_state["transcription"] = transcription
-        except Exception as e:
-            st.error(f"❌ Erro na transcrição: {str(e)}")
-            st.stop()
-    
-    # Step 2: Analysis with Claude
-    with st.spinner("🧠 Analisando transcrição com Claude..."):
-        try:
-            from core import analyze_transcription
-            sumario = analyze_transcription(
-                transcription=transcription,
-                anthropic_api_key=anthropic_api_key
-            )
-            st.session_state["sumario"] = sumario
-            st.session_state["sumario_text"] = sumario.formatar()
-        except Exception as e:
-            st.error(f"❌ Erro na análise: {str(e)}")
-            st.stop()
-    
-    st.success("✅ Processamento concluído!")
+if process_button and uploaded_files:
+    
+    # Results already shown in this session are keyed by audio content, so
+    # clicking again skips the pipeline entirely; across reloads and sessions
+    # the memoized transcription/analysis in core avoids the API calls
+    cache = st.session_state.setdefault("resultados_cache", {})
+    
+    audios = {}
+    for uploaded_file in uploaded_files:
+        audios.setdefault(audio_digest(uploaded_file), (uploaded_file.name, uploaded_file))
+    pendentes = [digest for digest in audios if digest not in cache]
+    
+    # Transcription (Groq Whisper) + analysis (Claude) for every new file,
+    # with the per-file pipelines running concurrently
+    if pendentes:
+        with st.spinner(f"🎤🧠 Transcrevendo e analisando {len(pendentes)} áudio(s)..."):
+            try:
+                resultados = asyncio.run(process_audios_async(
+                    audios=[audios[digest] for digest in pendentes],
+                    groq_api_key=groq_api_key,
+                    anthropic_api_key=anthropic_api_key,
+                    batch=batch_mode
+                ))
+            except Exception as e:
+                st.error(f"❌ Erro no processamento: {str(e)}")
+                st.stop()
+        
+        for digest, resultado in zip(pendentes, resultados):
+            filename = audios[digest][0]
+            if isinstance(resultado, BaseException):
+                st.error(f"❌ Erro ao processar {filename}: {str(resultado)}")
+                continue
+            transcription, sumario = resultado
+            cache[digest] = {
+                "filename": filename,
+                "transcription": transcription,
+                "sumario": sumario,
+                "sumario_text": sumario.formatar(),
+            }
+    
+    st.session_state["resultados"] = [cache[digest] for digest in audios if digest in cache]
+    
+    if st.session_state["resultados"]:
+        st.success("✅ Processamento concluído!")
 
 # =============================================================================
 # RESULTS DISPLAY
 # =============================================================================
 
-if "transcription" in st.session_state:
+# Fragments: interacting with a result (text area, expanders) reruns only
+# that fragment instead of the whole script
+
+@st.fragment
+def render_transcription(transcription: str):
     with st.expander("📝 Ver transcrição do áudio", expanded=False):
-        st.markdown(f'<div class="transcription-box">{st.session_state["transcription"]}</div>', 
+        st.markdown(f'<div class="transcription-box">{transcription}</div>', 
                     unsafe_allow_html=True)
 
-if "sumario" in st.session_state:
+
+@st.fragment
+def render_results(index: int, sumario: SumarioPaciente, sumario_text: str):
     st.markdown("### 📋 Sumário Gerado")
     
-    sumario = st.session_state["sumario"]
-    sumario_text = st.session_state["sumario_text"]
-    
     # Display structured summary
     st.markdown(f"**Leito {sumario.leito}** - {sumario.nome_paciente}")
     
@@ -232,12 +256,24 @@ if "sumario" in st.session_state:
         label="Sumário formatado",
         value=sumario_text,
         height=300,
-        label_visibility="collapsed"
+        label_visibility="collapsed",
+        key=f"sumario_text_{index}"
     )
     
     # JSON view
     with st.expander("🔧 Ver dados em JSON"):
-        st.json(sumario.model_dump())
+        st.code(sumario.model_dump_json(indent=2), language="json")
+
+
+resultados = st.session_state.get("resultados", [])
+
+for index, resultado in enumerate(resultados):
+    if len(resultados) > 1:
+        st.divider()
+        st.markdown(f"#### 🎵 {resultado['filename']}")
+    
+    render_transcription(resultado["transcription"])
+    render_results(index, resultado["sumario"], resultado["sumario_text"])
 
 # =============================================================================
 # FOOTER
@@ -10,16 +10,19 @@ Features:
 
 import streamlit as st
 from dotenv import load_dotenv
-import os
-import json
-from anthropic import Anthropic
+import time
 
 from core import (
     SumarioPaciente, 
     SYSTEM_PROMPT, 
     transcribe_audio,
+    get_api_keys,
+    get_anthropic_client,
+    audio_mime_type,
+    AUDIO_MIME_TYPES,
     WHISPER_MODEL,
-    CLAUDE_MODEL
+    CLAUDE_MODEL,
+    SUMMARY_MODEL
 )
 
 # Load environment variables
@@ -66,6 +69,146 @@ Exemplo:
 </sumario_json>
 """
 
+CHAT_SYSTEM_BLOCKS = [{"type": "text", "text": CHAT_SYSTEM_PROMPT}]
+
+# =============================================================================
+# CHAT HISTORY WINDOW
+# =============================================================================
+
+MAX_RECENT = 8  # Messages sent verbatim to Claude; older ones are summarized
+
+HISTORY_SUMMARY_PROMPT = """Você resume conversas entre um médico e um assistente que monta sumários de pacientes de UTI.
+
+Atualize o resumo anterior incorporando as novas mensagens, em um único parágrafo.
+Preserve TODOS os dados clínicos citados (leito, nome, diagnósticos, pendências, condutas, doses, datas) e as correções feitas pelo usuário.
+Não invente informações."""
+
+
+def summarize_history(summary: str | None, messages: list[dict], anthropic_api_key: str) -> str:
+    """
+    Atualiza o resumo do histórico antigo com novas mensagens (Claude Haiku).
+    
+    Args:
+        summary: Resumo anterior (ou None)
+        messages: Mensagens que saem da janela recente
+        anthropic_api_key: Anthropic API Key
+    
+    Returns:
+        Resumo atualizado
+    """
+    conversation = "\n\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    
+    response = get_anthropic_client(anthropic_api_key).messages.create(
+        model=SUMMARY_MODEL,
+        max_tokens=1024,
+        system=HISTORY_SUMMARY_PROMPT,
+        messages=[{
+            "role": "user",
+            "content": f"RESUMO ANTERIOR:\n{summary or '(nenhum)'}\n\nNOVAS MENSAGENS:\n{conversation}"
+        }]
+    )
+    
+    return response.content[0].text
+
+
+def windowed_history(anthropic_api_key: str) -> tuple[list[dict], list[dict]]:
+    """
+    Janela de histórico enviada ao Claude: resumo + últimas MAX_RECENT mensagens.
+    
+    O resumo só é recalculado quando a janela passa de MAX_RECENT + 2 mensagens,
+    e a janela sempre começa numa mensagem do usuário. Se o resumo falhar, o
+    estado não muda e a janela atual (sem resumir) é enviada neste turno.
+    
+    Returns:
+        Tuple of (system blocks, messages), with the prompt caching
+        breakpoint on the last message
+    """
+    messages = st.session_state.messages
+    start = st.session_state.history_start
+    
+    if len(messages) - start > MAX_RECENT + 2:
+        new_start = len(messages) - MAX_RECENT
+        if messages[new_start]["role"] == "assistant":
+            new_start += 1
+        try:
+            summary = summarize_history(
+                st.session_state.history_summary, messages[start:new_start], anthropic_api_key
+            )
+        except Exception:
+            pass  # Retried on the next turn; the reply must not depend on it
+        else:
+            st.session_state.history_summary = summary
+            st.session_state.history_start = new_start
+    
+    system = CHAT_SYSTEM_BLOCKS
+    if st.session_state.history_summary:
+        system = [*CHAT_SYSTEM_BLOCKS, {
+            "type": "text",
+            "text": f"Contexto anterior da conversa (resumo):\n{st.session_state.history_summary}",
+        }]
+    
+    # The system prompt alone is below the minimum cacheable length; marking
+    # the last message caches system + conversation, so the next turn only
+    # prefills the new exchange. Copied so session_state keeps plain strings.
+    window = messages[st.session_state.history_start:]
+    if window:
+        last = window[-1]
+        window = [*window[:-1], {
+            "role": last["role"],
+            "content": [{
+                "type": "text",
+                "text": last["content"],
+                "cache_control": {"type": "ephemeral"},
+            }],
+        }]
+    
+    return system, window
+
+# =============================================================================
+# STREAMING
+# =============================================================================
+
+STREAM_FLUSH_INTERVAL = 0.04  # Minimum seconds between placeholder updates
+STREAM_FLUSH_CHARS = 32       # ...unless this many characters are buffered
+
+
+def stream_response(
+    system: list[dict],
+    messages: list[dict],
+    placeholder,
+    anthropic_api_key: str
+) -> str:
+    """
+    Faz o streaming da resposta do Claude para o placeholder.
+    
+    O placeholder é atualizado no máximo a cada STREAM_FLUSH_INTERVAL segundos
+    (ou quando STREAM_FLUSH_CHARS caracteres se acumulam), em vez de a cada
+    token, reduzindo o número de re-renderizações enviadas ao navegador.
+    
+    Returns:
+        Texto completo da resposta
+    """
+    full_response = ""
+    buffered = 0
+    last_flush = time.monotonic()
+    
+    with get_anthropic_client(anthropic_api_key).messages.stream(
+        model=CLAUDE_MODEL,
+        max_tokens=2048,
+        system=system,
+        messages=messages
+    ) as stream:
+        for text in stream.text_stream:
+            full_response += text
+            buffered += len(text)
+            now = time.monotonic()
+            if buffered > STREAM_FLUSH_CHARS or now - last_flush > STREAM_FLUSH_INTERVAL:
+                placeholder.markdown(full_response + "▌")
+                buffered = 0
+                last_flush = now
+    
+    return full_response
+
 # =============================================================================
 # INITIALIZE SESSION STATE
 # =============================================================================
@@ -79,22 +222,21 @@ if "transcription" not in st.session_state:
 if "sumario_final" not in st.session_state:
     st.session_state.sumario_final = None
 
+if "sumario_final_text" not in st.session_state:
+    st.session_state.sumario_final_text = None
+
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = None
+
+if "history_start" not in st.session_state:
+    st.session_state.history_start = 0
+
 # =============================================================================
 # API KEYS
 # =============================================================================
 
-# Try Streamlit secrets first, then environment variables
-try:
-    groq_api_key = st.secrets.get("GROQ_API_KEY", None)
-    anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY", None)
-except:
-    groq_api_key = None
-    anthropic_api_key = None
-
-if not groq_api_key:
-    groq_api_key = os.environ.get("GROQ_API_KEY", None)
-if not anthropic_api_key:
-    anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY", None)
+# Streamlit secrets first, then environment variables; resolved once per process
+groq_api_key, anthropic_api_key = get_api_keys()
 
 # Check for missing keys
 missing_keys = []
@@ -108,9 +250,6 @@ if missing_keys:
     st.info("Configure no arquivo `.env` ou em Streamlit Cloud Secrets.")
     st.stop()
 
-# Initialize Anthropic client
-client = Anthropic(api_key=anthropic_api_key)
-
 # =============================================================================
 # HEADER
 # =============================================================================
@@ -127,21 +266,20 @@ with st.sidebar:
     
     uploaded_file = st.file_uploader(
         "Arraste um arquivo de áudio",
-        type=["mp3", "wav", "m4a", "opus", "ogg", "webm", "flac"],
+        type=list(AUDIO_MIME_TYPES),
         help="O áudio será transcrito automaticamente"
     )
     
     if uploaded_file is not None:
-        st.audio(uploaded_file)
+        st.audio(uploaded_file, format=audio_mime_type(uploaded_file.name))
         
         if st.button("🎤 Transcrever Áudio", use_container_width=True):
             with st.spinner("Transcrevendo com Whisper..."):
                 try:
-                    audio_bytes = uploaded_file.read()
                     transcription = transcribe_audio(
-                        audio_bytes=audio_bytes,
+                        audio_file=uploaded_file,
                         filename=uploaded_file.name,
-                        groq_api_key=groq_api_key
+                        _groq_api_key=groq_api_key
                     )
                     st.session_state.transcription = transcription
                     
@@ -169,10 +307,10 @@ with st.sidebar:
         st.header("📋 Sumário Final")
         sumario = st.session_state.sumario_final
         st.markdown(f"**Leito {sumario.leito}** - {sumario.nome_paciente}")
-        st.text_area("Copiar:", value=sumario.formatar(), height=200)
+        st.text_area("Copiar:", value=st.session_state.sumario_final_text, height=200)
         
         with st.expander("Ver JSON"):
-            st.json(sumario.model_dump())
+            st.code(sumario.model_dump_json(indent=2), language="json")
     
     st.divider()
     
@@ -180,6 +318,9 @@ with st.sidebar:
         st.session_state.messages = []
         st.session_state.transcription = None
         st.session_state.sumario_final = None
+        st.session_state.sumario_final_text = None
+        st.session_state.history_summary = None
+        st.session_state.history_start = 0
         st.rerun()
 
 # =============================================================================
@@ -206,24 +347,13 @@ if prompt := st.chat_input("Digite sua mensagem ou cole uma transcrição..."):
     # Generate response
     with st.chat_message("assistant", avatar="🤖"):
         message_placeholder = st.empty()
-        full_response = ""
-        
-        # Build messages for API
-        api_messages = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in st.session_state.messages
-        ]
         
-        # Stream response
-        with client.messages.stream(
-            model=CLAUDE_MODEL,
-            max_tokens=2048,
-            system=CHAT_SYSTEM_PROMPT,
-            messages=api_messages
-        ) as stream:
-            for text in stream.text_stream:
-                full_response += text
-                message_placeholder.markdown(full_response + "▌")
+        # Session messages are already {"role", "content"} dicts (API shape);
+        # only the recent window is sent, older turns go in as a summary
+        system, api_messages = windowed_history(anthropic_api_key)
+        full_response = stream_response(
+            system, api_messages, message_placeholder, anthropic_api_key
+        )
         
         message_placeholder.markdown(full_response)
     
@@ -237,9 +367,9 @@ if prompt := st.chat_input("Digite sua mensagem ou cole uma transcrição..."):
             json_end = full_response.index("</sumario_json>")
             json_str = full_response[json_start:json_end].strip()
             
-            data = json.loads(json_str)
-            sumario = SumarioPaciente(**data)
+            sumario = SumarioPaciente.model_validate_json(json_str)
             st.session_state.sumario_final = sumario
+            st.session_state.sumario_final_text = sumario.formatar()
             
             st.success("✅ Sumário extraído! Veja na barra lateral.")
             st.rerun()
@@ -0,0 +1,187 @@
+"""
+DocScribe - Dynamic request batching for Groq Whisper transcription.
+
+Transcription requests from every Streamlit session are fed into a single
+queue. A background event loop accumulates them for a short window (or until
+the batch is full), groups them into size buckets and sends each bucket as
+parallel requests, so per-request overhead is amortized and a short clip is
+never held back waiting for a long one.
+
+Contains:
+- TranscriptionRequest dataclass
+- TranscriptionBatcher (background loop + accumulation window + bucketing)
+"""
+
+import asyncio
+import io
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Hashable, Optional
+
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+MAX_WAIT = 0.05  # Accumulation window (seconds)
+MAX_SIZE = 8     # Maximum requests per batch
+
+
+# =============================================================================
+# REQUEST
+# =============================================================================
+
+@dataclass
+class TranscriptionRequest:
+    """Uma requisição de transcrição aguardando na fila do batcher."""
+
+    audio_file: BinaryIO
+    filename: str
+    groq_api_key: str
+    params: dict[str, Any] = field(default_factory=dict)
+    future: Future = field(default_factory=Future)
+
+
+def size_bucket(request: TranscriptionRequest) -> Hashable:
+    """Agrupa requisições por tamanho do áudio (em MB)."""
+    size = request.audio_file.seek(0, io.SEEK_END)
+    request.audio_file.seek(0)
+    return round(size / 2**20)
+
+
+# =============================================================================
+# BATCHER
+# =============================================================================
+
+class TranscriptionBatcher:
+    """
+    Fila de transcrições com janela de acumulação e agrupamento por tamanho.
+
+    Roda em um event loop próprio numa thread daemon, compartilhado entre todas
+    as sessões do Streamlit. `submit` pode ser chamado de qualquer thread e
+    devolve um concurrent.futures.Future com a resposta do Groq.
+    """
+
+    def __init__(
+        self,
+        transcription_params: dict[str, Any],
+        max_wait: float = MAX_WAIT,
+        max_size: int = MAX_SIZE,
+        bucket_key: Callable[[TranscriptionRequest], Hashable] = size_bucket
+    ):
+        """
+        Args:
+            transcription_params: Parâmetros fixos de audio.transcriptions.create
+                (model, temperature, response_format, ...)
+            max_wait: Tempo máximo de acumulação de um batch (segundos)
+            max_size: Número máximo de requisições por batch
+            bucket_key: Função que define o bucket de cada requisição
+        """
+        self._params = transcription_params
+        self._max_wait = max_wait
+        self._max_size = max_size
+        self._bucket_key = bucket_key
+        self._clients = {}
+        self._flushes = set()
+
+        self._loop = asyncio.new_event_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        threading.Thread(
+            target=self._loop.run_forever,
+            name="transcription-batcher",
+            daemon=True
+        ).start()
+        asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    def submit(
+        self,
+        audio_file: BinaryIO,
+        filename: str,
+        groq_api_key: str,
+        params: Optional[dict[str, Any]] = None
+    ) -> Future:
+        """
+        Enfileira um áudio para transcrição.
+
+        Args:
+            audio_file: Arquivo de áudio (file-like)
+            filename: Nome do arquivo (para detectar extensão)
+            groq_api_key: Groq API Key
+            params: Parâmetros que sobrescrevem os fixos só nesta requisição
+                (ex: response_format)
+
+        Returns:
+            Future resolvido com a resposta do Groq (`.text` tem a transcrição)
+        """
+        request = TranscriptionRequest(audio_file, filename, groq_api_key, params or {})
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, request)
+        return request.future
+
+    def _client(self, groq_api_key: str):
+        """AsyncGroq client per API key, bound to the batcher loop."""
+        if groq_api_key not in self._clients:
+            from groq import AsyncGroq
+            self._clients[groq_api_key] = AsyncGroq(api_key=groq_api_key)
+        return self._clients[groq_api_key]
+
+    async def _collect(self) -> list[TranscriptionRequest]:
+        """Wait for a first request, then accumulate until max_wait or max_size."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self._max_wait
+
+        while len(batch) < self._max_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await self._collect()
+
+                buckets: dict[Hashable, list[TranscriptionRequest]] = {}
+                for request in batch:
+                    try:
+                        key = self._bucket_key(request)
+                    except Exception as e:
+                        if request.future.set_running_or_notify_cancel():
+                            request.future.set_exception(e)
+                        continue
+                    buckets.setdefault(key, []).append(request)
+
+                # Flush buckets independently so short clips resolve without
+                # waiting for long ones, and keep collecting the next batch.
+                for bucket in buckets.values():
+                    task = self._loop.create_task(self._flush(bucket))
+                    self._flushes.add(task)
+                    task.add_done_callback(self._flushes.discard)
+            except Exception:
+                # Never let the shared loop die: later submits would hang forever
+                continue
+
+    async def _flush(self, bucket: list[TranscriptionRequest]):
+        # Each future resolves as soon as its own request completes, so a
+        # short clip never waits for the slowest request in its bucket
+        await asyncio.gather(*(self._transcribe(request) for request in bucket))
+
+    async def _transcribe(self, request: TranscriptionRequest):
+        # Marks the future as running: from here on the caller can no longer
+        # cancel it, so setting the result below cannot raise
+        if not request.future.set_running_or_notify_cancel():
+            return  # Cancelled by the caller before it was sent
+        try:
+            result = await self._client(request.groq_api_key).audio.transcriptions.create(
+                file=(request.filename, request.audio_file),
+                **{**self._params, **request.params}
+            )
+        except Exception as e:
+            request.future.set_exception(e)
+        else:
+            request.future.set_result(result)
@@ -10,13 +10,26 @@ Contains:
 - System and human prompts
 - Transcription function (Groq)
 - Analysis function (Anthropic)
+- Async variants for processing several audios concurrently
 """
 
+import asyncio
+import hashlib
+import io
 import json
+import mmap
 import os
+import shutil
+import subprocess
 import tempfile
-from typing import Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional
+import streamlit as st
 from pydantic import BaseModel, Field
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from batcher import TranscriptionBatcher
 
 
 # =============================================================================
@@ -52,23 +65,15 @@ class SumarioPaciente(BaseModel):
     
     def formatar(self) -> str:
         """Formata o sumário no padrão de saída para exibição."""
-        linhas = [f"Leito {self.leito} - {self.nome_paciente}", ""]
-        
-        linhas.append("Diagnósticos:")
-        for i, diag in enumerate(self.diagnosticos, 1):
-            linhas.append(f"{i}- {diag}")
-        linhas.append("")
-        
-        linhas.append("Pendências:")
-        for i, pend in enumerate(self.pendencias, 1):
-            linhas.append(f"{i}- {pend}")
-        linhas.append("")
-        
-        linhas.append("Condutas:")
-        for conduta in self.condutas:
-            linhas.append(f"• {conduta}")
-        
-        return "\n".join(linhas)
+        return "\n".join([
+            f"Leito {self.leito} - {self.nome_paciente}", "",
+            "Diagnósticos:",
+            *(f"{i}- {diag}" for i, diag in enumerate(self.diagnosticos, 1)), "",
+            "Pendências:",
+            *(f"{i}- {pend}" for i, pend in enumerate(self.pendencias, 1)), "",
+            "Condutas:",
+            *(f"• {conduta}" for conduta in self.condutas),
+        ])
 
 
 # =============================================================================
@@ -157,6 +162,46 @@ CHECKLIST antes de responder:
 4. Condutas: Consolidei itens relacionados? Incluí justificativas e doses?
 5. Terminologia: Usei "IRA" (não "disfunção renal"), "norepinefrina" (não "noraepinefrina")?"""
 
+# Structured-output tool, built once at import instead of walking the
+# Pydantic model on every request
+_SUMARIO_SCHEMA = SumarioPaciente.model_json_schema()
+
+_SUMARIO_TOOL = {
+    "name": "SumarioPaciente",
+    "description": "Registra o sumário estruturado do paciente.",
+    "input_schema": _SUMARIO_SCHEMA,
+}
+
+# Static system prompt marked as a prompt-cache breakpoint: the tools + system
+# prefix stays cached server-side, so only the transcription is prefilled
+_SYSTEM_BLOCKS = [{
+    "type": "text",
+    "text": SYSTEM_PROMPT,
+    "cache_control": {"type": "ephemeral"},
+}]
+
+
+# =============================================================================
+# AUDIO FORMATS
+# =============================================================================
+
+# Accepted upload extensions → MIME type for the browser audio player
+AUDIO_MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "m4a": "audio/mp4",
+    "opus": "audio/ogg",
+    "ogg": "audio/ogg",
+    "webm": "audio/webm",
+    "flac": "audio/flac",
+}
+
+
+def audio_mime_type(filename: str) -> str:
+    """MIME type do áudio a partir da extensão do arquivo."""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    return AUDIO_MIME_TYPES.get(extension, "audio/mpeg")
+
 
 # =============================================================================
 # MODELS
@@ -164,54 +209,494 @@ CHECKLIST antes de responder:
 
 WHISPER_MODEL = "whisper-large-v3-turbo"  # Groq's fastest Whisper model
 CLAUDE_MODEL = "claude-sonnet-4-5-20250929"  # Claude Sonnet 4
+SUMMARY_MODEL = "claude-haiku-4-5-20251001"  # Claude Haiku (chat history summaries)
+
+# Message Batches polling (Anthropic)
+BATCH_POLL_INITIAL = 5.0      # First poll delay (seconds), doubled each poll
+BATCH_POLL_MAX = 60.0         # Maximum delay between polls (seconds)
+BATCH_TIMEOUT = 10 * 60       # Fall back to real-time requests after this (seconds)
+BATCH_MAX_RETRIES = 3         # Retries (exponential backoff) for each API call
+BATCH_FALLBACK_WORKERS = 8    # Parallel real-time requests when falling back
+
+# Re-encoding before upload to Whisper (ffmpeg): 16 kHz mono Opus keeps
+# Whisper accuracy at a fraction of the bytes of WAV/FLAC or large files
+COMPRESS_EXTENSIONS = {"wav", "flac"}
+COMPRESS_MIN_BYTES = 5_000_000
+PCM_SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2  # 16-bit mono
+FFMPEG_PCM_OUTPUT_ARGS = ["-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-f", "s16le"]
+FFMPEG_OPUS_ARGS = ["-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "-c:a", "libopus", "-b:a", "16k", "-f", "ogg"]
+
+# Long audios are split on silence (VAD) and the chunks transcribed in parallel
+LONG_AUDIO_SECONDS = 10 * 60  # Split audios longer than this
+CHUNK_SECONDS = 5 * 60        # Target chunk length
+CUT_SEARCH_SECONDS = 30       # Look back this far from each target cut for silence
+CUT_MIN_SILENCE_MS = 200      # Shorter non-speech runs are not a safe cut
+CUT_OVERLAP_SECONDS = 0.5     # Overlap between chunks when no silence is found
+VAD_FRAME_MS = 30             # webrtcvad accepts 10, 20 or 30 ms frames
+VAD_AGGRESSIVENESS = 2        # 0 (least) to 3 (most aggressive)
+
+# Memoization of transcription/analysis results (st.cache_data)
+CACHE_TTL = 24 * 60 * 60  # seconds
+HASH_CHUNK_SIZE = 2**20   # bytes read per step when hashing audio files
+
+# Only the text is used: "json" returns just {"text": ...}, while
+# "verbose_json" also serializes segments, timestamps and logprobs
+TRANSCRIPTION_PARAMS = {
+    "model": WHISPER_MODEL,
+    "temperature": 0,
+    "response_format": "json",
+}
+
+# Chunks that overlap need word timestamps to drop the repeated words
+OVERLAP_TRANSCRIPTION_PARAMS = {
+    "response_format": "verbose_json",
+    "timestamp_granularities": ["word"],
+}
+
+
+def audio_digest(audio_file: BinaryIO) -> str:
+    """
+    Hash do conteúdo do áudio, usado como chave de cache.
+    
+    Lê o arquivo em blocos (sem copiá-lo inteiro para memória) e volta o
+    ponteiro para o início ao terminar.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    audio_file.seek(0)
+    while chunk := audio_file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    audio_file.seek(0)
+    return digest.hexdigest()
+
+
+# Hash uploaded audio by content (in chunks) instead of Streamlit's default,
+# which copies the whole buffer
+_AUDIO_HASH_FUNCS = {UploadedFile: audio_digest, io.BytesIO: audio_digest}
+
+
+# =============================================================================
+# API KEYS
+# =============================================================================
+
+@st.cache_resource(show_spinner=False)
+def get_api_keys() -> tuple[Optional[str], Optional[str]]:
+    """
+    Resolve as chaves de API uma vez por processo (não a cada rerun).
+    
+    Tenta primeiro os Streamlit secrets (Streamlit Cloud) e depois as
+    variáveis de ambiente (arquivo .env, carregado pelas apps).
+    
+    Returns:
+        Tuple of (groq_api_key, anthropic_api_key); None para chaves ausentes
+    """
+    try:
+        groq_api_key = st.secrets.get("GROQ_API_KEY", None)
+        anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY", None)
+    except Exception:
+        # No secrets.toml (local run)
+        groq_api_key = None
+        anthropic_api_key = None
+    
+    return (
+        groq_api_key or os.environ.get("GROQ_API_KEY", None),
+        anthropic_api_key or os.environ.get("ANTHROPIC_API_KEY", None),
+    )
+
+
+# =============================================================================
+# CLIENTS (CACHED ACROSS RERUNS)
+# =============================================================================
+# Streamlit reruns the whole script on every interaction; caching the clients
+# keeps one connection pool (and TLS session) per API key for the process.
+# Async clients are bound to an event loop and are not cached here.
+
+@st.cache_resource(show_spinner=False)
+def get_anthropic_client(anthropic_api_key: str):
+    """Cliente Anthropic compartilhado entre reruns e sessões."""
+    from anthropic import Anthropic
+    
+    return Anthropic(api_key=anthropic_api_key)
+
+
+@st.cache_resource(show_spinner=False)
+def get_transcription_batcher() -> TranscriptionBatcher:
+    """Batcher de transcrições compartilhado por todas as sessões."""
+    return TranscriptionBatcher(TRANSCRIPTION_PARAMS)
 
 
 # =============================================================================
 # TRANSCRIPTION (GROQ WHISPER)
 # =============================================================================
 
+def _ffmpeg(args: list[str]) -> Optional[bytes]:
+    """
+    Roda o ffmpeg e devolve a saída (stdout).
+    
+    Args:
+        args: Argumentos do ffmpeg, com a entrada como caminho de arquivo
+            (a saída é sempre pipe:1)
+    
+    Returns:
+        Bytes produzidos, ou None se o ffmpeg falhar
+    """
+    process = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", *args, "pipe:1"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    
+    if process.returncode != 0 or not process.stdout:
+        return None
+    return process.stdout
+
+
+def _audio_duration(path: str) -> Optional[float]:
+    """
+    Duração do áudio em segundos, lida do container pelo ffprobe (sem decodificar).
+    
+    Returns:
+        Duração, ou None se o ffprobe não estiver instalado ou não a informar
+    """
+    if shutil.which("ffprobe") is None:
+        return None
+    
+    process = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", path],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True
+    )
+    try:
+        return float(process.stdout)
+    except ValueError:
+        return None  # "N/A" or empty (ex: streams without a duration header)
+
+
+def _split_by_vad(pcm: mmap.mmap) -> list[tuple[float, Optional[float]]]:
+    """
+    Divide áudio PCM (16 kHz mono, 16 bits) em trechos de ~CHUNK_SECONDS.
+    
+    Cada corte é feito no meio do maior silêncio (segundo o webrtcvad) dentro
+    dos CUT_SEARCH_SECONDS anteriores ao ponto alvo, para não cortar palavras.
+    Se a janela não tiver um silêncio de pelo menos CUT_MIN_SILENCE_MS, o
+    corte fica no ponto alvo e o trecho seguinte começa CUT_OVERLAP_SECONDS
+    antes, para que a palavra cortada apareça inteira em um dos dois (a
+    repetição é removida em _join_transcriptions).
+    
+    Só um quadro de VAD_FRAME_MS é lido por vez, então o PCM pode ser um
+    arquivo mapeado em memória em vez de bytes carregados.
+    
+    Returns:
+        Lista de (início, fim) de cada trecho em segundos; o fim do último é None
+    """
+    import webrtcvad
+    
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    frame_bytes = PCM_BYTES_PER_SECOND * VAD_FRAME_MS // 1000
+    frames_per_chunk = CHUNK_SECONDS * 1000 // VAD_FRAME_MS
+    search_frames = CUT_SEARCH_SECONDS * 1000 // VAD_FRAME_MS
+    overlap_frames = int(CUT_OVERLAP_SECONDS * 1000) // VAD_FRAME_MS
+    min_silence_frames = -(-CUT_MIN_SILENCE_MS // VAD_FRAME_MS)
+    total_frames = len(pcm) // frame_bytes
+    
+    def seconds(frame: int) -> float:
+        return frame * VAD_FRAME_MS / 1000
+    
+    ranges = []
+    start = 0
+    while total_frames - start > frames_per_chunk:
+        target = start + frames_per_chunk
+        cut = target
+        
+        # Longest run of non-speech frames in the search window
+        best_length = 0
+        run_start = None
+        for frame in range(target - search_frames, target + 1):
+            silent = frame < target and not vad.is_speech(
+                pcm[frame * frame_bytes:(frame + 1) * frame_bytes], PCM_SAMPLE_RATE
+            )
+            if silent and run_start is None:
+                run_start = frame
+            elif not silent and run_start is not None:
+                if frame - run_start > best_length:
+                    best_length = frame - run_start
+                    cut = (run_start + frame) // 2
+                run_start = None
+        
+        if best_length < min_silence_frames:
+            cut = target  # A frame or two of non-speech can still be mid-word
+        
+        ranges.append((seconds(start), seconds(cut)))
+        start = cut if best_length >= min_silence_frames else cut - overlap_frames
+    
+    ranges.append((seconds(start), None))
+    return ranges
+
+
+def prepare_audio(audio_file: BinaryIO, filename: str) -> list[tuple[BinaryIO, str, float]]:
+    """
+    Prepara o áudio para o Whisper: recodifica e divide áudios longos.
+    
+    O upload é copiado (em blocos) para um arquivo temporário, para que o
+    ffmpeg possa ler formatos que exigem entrada com seek (ex: M4A com o
+    índice no fim do arquivo, comum em gravações de celular). A duração vem
+    do ffprobe, sem decodificar o áudio:
+    
+    - Acima de LONG_AUDIO_SECONDS, qualquer que seja o formato, o áudio é
+      decodificado para PCM 16 kHz mono (em disco, lido por mmap), dividido
+      nos silêncios (_split_by_vad) e cada trecho é codificado em Opus.
+    - WAV/FLAC e arquivos maiores que COMPRESS_MIN_BYTES são codificados em
+      Opus inteiros.
+    - Os demais seguem como o arquivo original, sem passar pelo ffmpeg.
+    
+    Sem ffmpeg instalado, ou se a conversão falhar, o arquivo original é usado.
+    
+    Args:
+        audio_file: Arquivo de áudio (file-like, ex: UploadedFile)
+        filename: Nome do arquivo
+    
+    Returns:
+        Lista de (arquivo, nome do arquivo, segundos sobrepostos ao trecho
+        anterior) a transcrever, em ordem
+    """
+    original = [(audio_file, filename, 0.0)]
+    
+    size = audio_file.seek(0, io.SEEK_END)
+    audio_file.seek(0)
+    extension = filename.rsplit(".", 1)[-1].lower()
+    
+    compress = extension in COMPRESS_EXTENSIONS or size > COMPRESS_MIN_BYTES
+    
+    if shutil.which("ffmpeg") is None:
+        return original
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, f"source.{extension}")
+        with open(source, "wb") as source_file:
+            shutil.copyfileobj(audio_file, source_file)
+        audio_file.seek(0)
+        
+        # Unknown duration: decode to find out rather than risk one huge request
+        duration = _audio_duration(source)
+        if duration is not None and duration <= LONG_AUDIO_SECONDS and not compress:
+            return original
+        
+        ranges = [(0.0, None)]
+        if duration is None or duration > LONG_AUDIO_SECONDS:
+            pcm_path = os.path.join(workdir, "audio.pcm")
+            decoded = subprocess.run(
+                ["ffmpeg", "-loglevel", "error", "-i", source, *FFMPEG_PCM_OUTPUT_ARGS, pcm_path],
+                stdin=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            if decoded.returncode != 0 or not os.path.getsize(pcm_path):
+                return original
+            
+            pcm_seconds = os.path.getsize(pcm_path) / PCM_BYTES_PER_SECOND
+            if pcm_seconds > LONG_AUDIO_SECONDS:
+                with open(pcm_path, "rb") as pcm_file, \
+                        mmap.mmap(pcm_file.fileno(), 0, access=mmap.ACCESS_READ) as pcm:
+                    ranges = _split_by_vad(pcm)
+            elif not compress:
+                return original
+        
+        # Each chunk is cut from the source by timestamp (-ss/-t before -i)
+        encoded = [
+            _ffmpeg([
+                "-ss", f"{start:.3f}",
+                *(["-t", f"{end - start:.3f}"] if end is not None else []),
+                "-i", source,
+                *FFMPEG_OPUS_ARGS
+            ])
+            for start, end in ranges
+        ]
+    
+    if None in encoded:
+        return original
+    
+    overlaps = [0.0] + [
+        max(previous_end - start, 0.0)
+        for (_, previous_end), (start, _) in zip(ranges, ranges[1:])
+    ]
+    
+    stem = filename.rsplit(".", 1)[0]
+    if len(encoded) == 1:
+        return [(io.BytesIO(encoded[0]), f"{stem}.ogg", 0.0)]
+    return [
+        (io.BytesIO(data), f"{stem}-{i}.ogg", overlap)
+        for i, (data, overlap) in enumerate(zip(encoded, overlaps), 1)
+    ]
+
+
+def _join_transcriptions(responses: list, overlaps: list[float]) -> str:
+    """
+    Une as transcrições dos trechos de um mesmo áudio.
+    
+    Em cada emenda com sobreposição, as palavras (com timestamps do
+    verbose_json) são divididas no meio da região repetida: cada palavra fica
+    só no trecho em que cai o seu ponto médio, então nada é dito duas vezes.
+    
+    Args:
+        responses: Respostas do Groq, uma por trecho
+        overlaps: Segundos que cada trecho repete do anterior
+    
+    Returns:
+        Texto transcrito completo
+    """
+    if not any(overlaps):
+        return " ".join(response.text.strip() for response in responses)
+    
+    words = [response.text.split() for response in responses]
+    
+    for i in range(1, len(responses)):
+        if not overlaps[i]:
+            continue
+        half = overlaps[i] / 2
+        previous = dict(responses[i - 1])
+        current = dict(responses[i])
+        
+        # Counted from the ends, so only the words near the seam need to line
+        # up with the whitespace-split text
+        if previous.get("duration") is not None:
+            seam = previous["duration"] - half
+            tail = sum(
+                1 for word in map(dict, previous.get("words") or [])
+                if (word["start"] + word["end"]) / 2 >= seam
+            )
+            words[i - 1] = words[i - 1][:len(words[i - 1]) - tail]
+        head = sum(
+            1 for word in map(dict, current.get("words") or [])
+            if (word["start"] + word["end"]) / 2 < half
+        )
+        words[i] = words[i][head:]
+    
+    return " ".join(" ".join(chunk_words) for chunk_words in words if chunk_words)
+
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL, hash_funcs=_AUDIO_HASH_FUNCS)
 def transcribe_audio(
-    audio_bytes: bytes, 
+    audio_file: BinaryIO, 
     filename: str, 
-    groq_api_key: str
+    _groq_api_key: str
 ) -> str:
     """
     Transcreve áudio usando Groq Whisper.
     
+    O áudio é preparado (prepare_audio) e cada trecho passa pelo batcher
+    compartilhado, que agrupa transcrições concorrentes (desta e de outras
+    sessões, ou os trechos de um áudio longo) e as envia em paralelo.
+    
+    O resultado é memoizado pelo conteúdo do áudio: o mesmo arquivo não é
+    reenviado ao Groq dentro de CACHE_TTL, mesmo em outra sessão.
+    
     Args:
-        audio_bytes: Conteúdo do arquivo de áudio em bytes
+        audio_file: Arquivo de áudio (file-like, ex: UploadedFile)
         filename: Nome do arquivo (para detectar extensão)
-        groq_api_key: Groq API Key
+        _groq_api_key: Groq API Key (não faz parte da chave de cache)
     
     Returns:
         Texto transcrito
     """
-    from groq import Groq
+    chunks = prepare_audio(audio_file, filename)
+    overlaps = [overlap for _, _, overlap in chunks]
+    params = OVERLAP_TRANSCRIPTION_PARAMS if any(overlaps) else None
     
-    client = Groq(api_key=groq_api_key)
+    batcher = get_transcription_batcher()
+    futures = [
+        batcher.submit(chunk_file, chunk_name, _groq_api_key, params)
+        for chunk_file, chunk_name, _ in chunks
+    ]
     
-    # Groq accepts file tuple: (filename, bytes)
-    transcription = client.audio.transcriptions.create(
-        file=(filename, audio_bytes),
-        model=WHISPER_MODEL,
-        temperature=0,
-        response_format="verbose_json",
-    )
+    return _join_transcriptions([future.result() for future in futures], overlaps)
+
+
+async def transcribe_audio_async(
+    audio_file: BinaryIO,
+    filename: str,
+    groq_api_key: str
+) -> str:
+    """
+    Versão assíncrona de transcribe_audio.
+    
+    Roda a função memoizada numa thread, de modo que um áudio já transcrito
+    (nesta ou em outra sessão) não é reenviado ao Groq.
+    
+    Args:
+        audio_file: Arquivo de áudio (file-like, ex: UploadedFile)
+        filename: Nome do arquivo (para detectar extensão)
+        groq_api_key: Groq API Key
     
-    return transcription.text
+    Returns:
+        Texto transcrito
+    """
+    return await asyncio.to_thread(transcribe_audio, audio_file, filename, groq_api_key)
 
 
 # =============================================================================
 # TEXT ANALYSIS (ANTHROPIC CLAUDE)
 # =============================================================================
 
+def _analysis_params(transcription: str) -> dict:
+    """Parâmetros de messages.create para extrair o sumário via tool use."""
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": 2048,
+        "temperature": 0,
+        "system": _SYSTEM_BLOCKS,
+        "tools": [_SUMARIO_TOOL],
+        "tool_choice": {"type": "tool", "name": _SUMARIO_TOOL["name"]},
+        "messages": [{
+            "role": "user",
+            "content": HUMAN_PROMPT_TEMPLATE.format(transcription=transcription),
+        }],
+    }
+
+
+def _parse_sumario(content: list) -> SumarioPaciente:
+    """Extrai o SumarioPaciente do bloco tool_use de uma resposta do Claude."""
+    for block in content:
+        if block.type == "tool_use":
+            return SumarioPaciente.model_validate(block.input)
+    raise ValueError("Resposta do Claude não contém o sumário estruturado")
+
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
 def analyze_transcription(
     transcription: str,
-    anthropic_api_key: str
+    _anthropic_api_key: str
 ) -> SumarioPaciente:
     """
     Analisa a transcrição e extrai o sumário estruturado usando Claude.
     
+    O resultado é memoizado pelo texto da transcrição dentro de CACHE_TTL.
+    
+    Args:
+        transcription: Texto transcrito do áudio
+        _anthropic_api_key: Anthropic API Key (não faz parte da chave de cache)
+    
+    Returns:
+        SumarioPaciente com os dados extraídos
+    """
+    client = get_anthropic_client(_anthropic_api_key)
+    response = client.messages.create(**_analysis_params(transcription))
+    
+    return _parse_sumario(response.content)
+
+
+async def analyze_transcription_async(
+    transcription: str,
+    anthropic_api_key: str
+) -> SumarioPaciente:
+    """
+    Versão assíncrona de analyze_transcription.
+    
+    Roda a função memoizada numa thread (no cliente Anthropic em cache), de
+    modo que uma transcrição já analisada não é enviada de novo ao Claude.
+    
     Args:
         transcription: Texto transcrito do áudio
         anthropic_api_key: Anthropic API Key
@@ -219,30 +704,88 @@ def analyze_transcription(
     Returns:
         SumarioPaciente com os dados extraídos
     """
-    from langchain_anthropic import ChatAnthropic
-    from langchain_core.prompts import ChatPromptTemplate
+    return await asyncio.to_thread(analyze_transcription, transcription, anthropic_api_key)
+
+
+# =============================================================================
+# BATCH ANALYSIS (ANTHROPIC MESSAGE BATCHES)
+# =============================================================================
+
+def analyze_transcriptions_batch(
+    transcriptions: list[str],
+    anthropic_api_key: str,
+    timeout: float = BATCH_TIMEOUT
+) -> list[SumarioPaciente | Exception]:
+    """
+    Analisa várias transcrições pela Message Batches API do Claude.
+    
+    Custa até 50% menos que a API em tempo real, mas a latência é maior. Se o
+    batch não terminar dentro de `timeout`, ele é cancelado e as transcrições
+    são analisadas pela API em tempo real. Itens que falharem no batch também
+    são refeitos em tempo real; se essa análise falhar, a exceção é devolvida
+    na posição do item, sem afetar os demais.
+    
+    Args:
+        transcriptions: Textos transcritos dos áudios
+        anthropic_api_key: Anthropic API Key
+        timeout: Tempo máximo de espera pelo batch (segundos)
     
-    # Initialize Claude
-    llm = ChatAnthropic(
-        model=CLAUDE_MODEL,
-        api_key=anthropic_api_key,
-        temperature=0
+    Returns:
+        Lista de SumarioPaciente (ou a exceção do item), na mesma ordem de
+        `transcriptions`
+    """
+    client = get_anthropic_client(anthropic_api_key).with_options(
+        max_retries=BATCH_MAX_RETRIES
     )
     
-    # Configure for structured output
-    structured_llm = llm.with_structured_output(SumarioPaciente)
+    def analyze_now(transcription: str) -> SumarioPaciente | Exception:
+        try:
+            response = client.messages.create(**_analysis_params(transcription))
+            return _parse_sumario(response.content)
+        except Exception as e:
+            return e
+    
+    def analyze_all_now(pending: list[str]) -> list[SumarioPaciente | Exception]:
+        # Concurrent, so N fallbacks cost about one round-trip instead of N
+        if not pending:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(pending), BATCH_FALLBACK_WORKERS)) as executor:
+            return list(executor.map(analyze_now, pending))
     
-    # Create prompt
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM_PROMPT),
-        ("human", HUMAN_PROMPT_TEMPLATE)
+    batch = client.messages.batches.create(requests=[
+        {"custom_id": f"sumario-{i}", "params": _analysis_params(transcription)}
+        for i, transcription in enumerate(transcriptions)
     ])
     
-    # Create chain and invoke
-    chain = prompt | structured_llm
-    result = chain.invoke({"transcription": transcription})
+    # Poll with exponential backoff until the batch ends or we run out of time
+    deadline = time.monotonic() + timeout
+    delay = BATCH_POLL_INITIAL
+    while batch.processing_status != "ended":
+        if time.monotonic() + delay > deadline:
+            try:
+                client.messages.batches.cancel(batch.id)
+            except Exception:
+                pass  # The real-time fallback below does not depend on it
+            return analyze_all_now(transcriptions)
+        time.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX)
+        batch = client.messages.batches.retrieve(batch.id)
+    
+    sumarios = {}
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            try:
+                sumarios[entry.custom_id] = _parse_sumario(entry.result.message.content)
+            except Exception:
+                pass  # Redone in real time below
     
-    return result
+    failed = [i for i in range(len(transcriptions)) if f"sumario-{i}" not in sumarios]
+    redone = dict(zip(failed, analyze_all_now([transcriptions[i] for i in failed])))
+    
+    return [
+        sumarios[f"sumario-{i}"] if i not in redone else redone[i]
+        for i in range(len(transcriptions))
+    ]
 
 
 # =============================================================================
@@ -250,7 +793,7 @@ def analyze_transcription(
 # =============================================================================
 
 def process_audio(
-    audio_bytes: bytes,
+    audio_file: BinaryIO,
     filename: str,
     groq_api_key: str,
     anthropic_api_key: str
@@ -259,7 +802,7 @@ def process_audio(
     Processa áudio: transcrição (Groq) + análise (Claude).
     
     Args:
-        audio_bytes: Conteúdo do arquivo de áudio em bytes
+        audio_file: Arquivo de áudio (file-like, ex: UploadedFile)
         filename: Nome do arquivo
         groq_api_key: Groq API Key
         anthropic_api_key: Anthropic API Key
@@ -268,9 +811,96 @@ def process_audio(
         Tuple of (transcription_text, SumarioPaciente)
     """
     # Step 1: Transcribe with Groq Whisper
-    transcription = transcribe_audio(audio_bytes, filename, groq_api_key)
+    transcription = transcribe_audio(audio_file, filename, groq_api_key)
     
     # Step 2: Analyze with Claude
     sumario = analyze_transcription(transcription, anthropic_api_key)
     
     return transcription, sumario
+
+
+async def process_audio_async(
+    audio_file: BinaryIO,
+    filename: str,
+    groq_api_key: str,
+    anthropic_api_key: str
+) -> tuple[str, SumarioPaciente]:
+    """
+    Versão assíncrona de process_audio.
+    
+    Args:
+        audio_file: Arquivo de áudio (file-like, ex: UploadedFile)
+        filename: Nome do arquivo
+        groq_api_key: Groq API Key
+        anthropic_api_key: Anthropic API Key
+    
+    Returns:
+        Tuple of (transcription_text, SumarioPaciente)
+    """
+    transcription = await transcribe_audio_async(audio_file, filename, groq_api_key)
+    sumario = await analyze_transcription_async(transcription, anthropic_api_key)
+    
+    return transcription, sumario
+
+
+async def process_audios_async(
+    audios: list[tuple[str, BinaryIO]],
+    groq_api_key: str,
+    anthropic_api_key: str,
+    batch: bool = False
+) -> list[tuple[str, SumarioPaciente] | BaseException]:
+    """
+    Processa vários áudios concorrentemente.
+    
+    Cada áudio segue o pipeline transcrição → análise, mas os pipelines rodam
+    em paralelo: a transcrição de um áudio se sobrepõe à análise de outro.
+    Com `batch=True`, todas as transcrições são analisadas juntas pela Message
+    Batches API (menor custo, maior latência).
+    
+    Args:
+        audios: Lista de (filename, audio_file)
+        groq_api_key: Groq API Key
+        anthropic_api_key: Anthropic API Key
+        batch: Usar a Message Batches API para a análise
+    
+    Returns:
+        Lista, na mesma ordem de `audios`, com (transcription_text, SumarioPaciente)
+        ou a exceção levantada no processamento daquele áudio
+    """
+    if not batch:
+        return await asyncio.gather(
+            *(
+                process_audio_async(audio_file, filename, groq_api_key, anthropic_api_key)
+                for filename, audio_file in audios
+            ),
+            return_exceptions=True
+        )
+    
+    transcriptions = await asyncio.gather(
+        *(
+            transcribe_audio_async(audio_file, filename, groq_api_key)
+            for filename, audio_file in audios
+        ),
+        return_exceptions=True
+    )
+    
+    pending = [t for t in transcriptions if not isinstance(t, BaseException)]
+    try:
+        sumarios = (
+            await asyncio.to_thread(analyze_transcriptions_batch, pending, anthropic_api_key)
+            if pending else []
+        )
+    except Exception as e:
+        # Batch API failure (create/retrieve/results): report it per file
+        sumarios = [e] * len(pending)
+    sumarios = iter(sumarios)
+    
+    resultados = []
+    for t in transcriptions:
+        if isinstance(t, BaseException):
+            resultados.append(t)
+            continue
+        sumario = next(sumarios)
+        resultados.append(sumario if isinstance(sumario, Exception) else (t, sumario))
+    
+    return resultados